@@ -17,30 +17,109 @@ from __future__ import annotations
 import argparse
 import csv
 import json
+import os
+import struct
 import sys
-from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Dict, Iterable, List, Optional, Sequence, Tuple
 
-from PIL import Image
+from PIL import Image, JpegImagePlugin, PngImagePlugin  # noqa: F401
 
+# Register the JPEG/PNG loaders up front so the first Image.open (in the
+# parent or in any pool worker importing this module) skips Pillow's full
+# plugin scan.
+Image.preinit()
 
-@dataclass(frozen=True)
-class CsvBox:
-    """Normalized representation of a single annotation box.
+try:
+    import orjson
+except ImportError:  # optional, used for fast cache (de)serialization
+    orjson = None
 
-    Always stored as COCO bbox [x, y, width, height] in pixel units.
-    """
+try:
+    import numpy as np
+except ImportError:  # optional, used for C-level CSV parsing
+    np = None
+
+# Accepted header names per bbox component, in priority order.
+_X_KEYS = ("x", "xc", "x_center")
+_Y_KEYS = ("y", "yc", "y_center")
+_W_KEYS = ("w", "width", "dx")
+_H_KEYS = ("h", "height", "dy")
 
-    x: float
-    y: float
-    width: float
-    height: float
+_SIZE_CACHE_NAME = ".size_cache.json"
 
+# Extension lookup order when resolving a stem to an image file.
+_IMAGE_EXT_RANK = {".jpg": 0, ".JPG": 1, ".png": 2}
 
-def _lower_keys(mapping: Dict[str, str]) -> Dict[str, str]:
-    """Return a case-insensitive mapping by lowering keys."""
-    return {k.lower(): v for k, v in mapping.items()}
+
+def _scan_image_map(images_dir: Path) -> Dict[str, str]:
+    """Map each image stem to its path with one scandir pass.
+
+    Replaces per-stem existence probes: one directory read instead of up
+    to three stat calls per stem. When a stem exists with several
+    extensions, the one earliest in ``_IMAGE_EXT_RANK`` wins, matching
+    the old .jpg/.JPG/.png probe order.
+    """
+    image_map: Dict[str, str] = {}
+    ranks: Dict[str, int] = {}
+    if not images_dir.is_dir():
+        return image_map
+    with os.scandir(images_dir) as it:
+        for entry in it:
+            stem, ext = os.path.splitext(entry.name)
+            rank = _IMAGE_EXT_RANK.get(ext)
+            if rank is None:
+                continue
+            prev = ranks.get(stem)
+            if prev is None or rank < prev:
+                ranks[stem] = rank
+                image_map[stem] = entry.path
+    return image_map
+
+
+def _scan_csv_stems(annotations_dir: Path) -> set:
+    """Collect the stems of all CSV files with one scandir pass."""
+    if not annotations_dir.is_dir():
+        return set()
+    with os.scandir(annotations_dir) as it:
+        return {os.path.splitext(entry.name)[0] for entry in it if entry.name.endswith(".csv")}
+
+
+def _load_size_cache(out_dir: Path) -> Dict[str, List[int]]:
+    """Load the persisted image-size cache, returning {} when absent or stale."""
+    cache_path = out_dir / _SIZE_CACHE_NAME
+    if not cache_path.exists():
+        return {}
+    try:
+        raw = cache_path.read_bytes()
+        data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _save_size_cache(out_dir: Path, cache: Dict[str, List[int]]) -> None:
+    """Persist the image-size cache next to the generated annotations."""
+    cache_path = out_dir / _SIZE_CACHE_NAME
+    if orjson is not None:
+        cache_path.write_bytes(orjson.dumps(cache))
+    else:
+        cache_path.write_text(json.dumps(cache), encoding="utf-8")
+
+
+def _box_ann(x: float, y: float, width: float, height: float) -> Dict[str, object]:
+    """Build a COCO annotation dict for one box, minus id/image_id.
+
+    The bbox is [x, y, width, height] in pixel units; ``id`` and
+    ``image_id`` are assigned by the caller.
+    """
+    return {
+        "category_id": 1,
+        "bbox": [x, y, width, height],
+        "area": width * height,
+        "iscrowd": 0,
+    }
 
 
 def _read_split_list(split_file: Path) -> List[str]:
@@ -51,72 +130,194 @@ def _read_split_list(split_file: Path) -> List[str]:
     return [line for line in lines if line]
 
 
+def _image_size_from_header(image_path: Path) -> Optional[Tuple[int, int]]:
+    """Read (width, height) from JPEG/PNG headers without decoding pixels.
+
+    Parses the PNG IHDR chunk or scans JPEG SOF markers directly, so the
+    codec (libjpeg/zlib) is never touched. Returns None when the format is
+    not recognized.
+    """
+    with image_path.open("rb") as f:
+        head = f.read(24)
+        if len(head) < 10:
+            return None
+
+        # PNG: 8-byte signature, then IHDR with big-endian width/height.
+        if head.startswith(b"\x89PNG\r\n\x1a\n"):
+            width, height = struct.unpack(">II", head[16:24])
+            return width, height
+
+        # JPEG: scan markers for a SOF segment carrying the frame size.
+        if head.startswith(b"\xff\xd8"):
+            f.seek(2)
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+                code = marker[1]
+                if code in (0xD8, 0x01) or 0xD0 <= code <= 0xD7:
+                    continue  # standalone markers carry no payload
+                length_bytes = f.read(2)
+                if len(length_bytes) < 2:
+                    return None
+                (length,) = struct.unpack(">H", length_bytes)
+                if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+                    payload = f.read(5)
+                    if len(payload) < 5:
+                        return None
+                    height, width = struct.unpack(">HH", payload[1:5])
+                    return width, height
+                f.seek(length - 2, 1)
+
+    return None
+
+
 def _image_size(image_path: Path) -> Tuple[int, int]:
-    """Return (width, height) for an image path using PIL."""
+    """Return (width, height) for an image path.
+
+    Reads only the file header for JPEG/PNG; falls back to PIL for
+    anything else.
+    """
+    try:
+        size = _image_size_from_header(image_path)
+        if size is not None:
+            return size
+    except OSError:
+        pass
     with Image.open(image_path) as img:
         return img.width, img.height
 
 
-def _parse_csv_boxes(csv_path: Path) -> List[CsvBox]:
-    """Parse a single per-image CSV file and return COCO-style bboxes.
+def _find_column(fieldnames: Sequence[str], candidates: Sequence[str]) -> Optional[int]:
+    """Return the index of the first matching candidate column, or None."""
+    for candidate in candidates:
+        if candidate in fieldnames:
+            return fieldnames.index(candidate)
+    return None
+
+
+def _parse_csv_boxes_numpy(csv_path: Path) -> Optional[List[Dict[str, object]]]:
+    """Parse a bbox CSV with numpy when the header layout is recognized.
+
+    Returns None when the header cannot be mapped to x/y/width/height,
+    in which case the caller falls back to the row-by-row parser.
+    """
+    with csv_path.open(encoding="utf-8") as f:
+        header = f.readline()
+        # Skip blank lines (loadtxt does too) when probing for data rows.
+        for line in f:
+            if line.strip():
+                break
+        else:
+            return []
+    fieldnames = [name.strip().lstrip("#").lower() for name in header.split(",")]
+    cols = tuple(
+        _find_column(fieldnames, keys) for keys in (_X_KEYS, _Y_KEYS, _W_KEYS, _H_KEYS)
+    )
+    if any(col is None for col in cols):
+        return None
+
+    try:
+        arr = np.loadtxt(csv_path, delimiter=",", skiprows=1, usecols=cols, ndmin=2)
+    except ValueError:
+        # Non-numeric cells or ragged rows: let the tolerant parser handle it.
+        return None
+    return [_box_ann(row[0], row[1], row[2], row[3]) for row in arr.tolist()]
+
+
+def _parse_csv_boxes(csv_path: Path) -> List[Dict[str, object]]:
+    """Parse a single per-image CSV file and return COCO annotation dicts.
+
+    Each returned dict carries bbox/area/iscrowd/category_id; ``id`` and
+    ``image_id`` are filled in by the caller.
 
     The parser is resilient to header variants by using case-insensitive
     lookups. Supported schemas:
       - Rectangle: x, y, width, height
+
+    When numpy is available and the header maps cleanly onto one of the
+    known schemas, parsing is done in one vectorized pass.
     """
     if not csv_path.exists():
         return []
 
-    boxes: List[CsvBox] = []
+    if np is not None:
+        boxes_np = _parse_csv_boxes_numpy(csv_path)
+        if boxes_np is not None:
+            return boxes_np
+
+    boxes: List[Dict[str, object]] = []
     with csv_path.open(newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        if reader.fieldnames is None:
+        reader = csv.reader(f)
+        header_row = next(reader, None)
+        if header_row is None:
             return boxes
-        header = _lower_keys({k: k for k in reader.fieldnames})
-        
-        def get(row: Dict[str, str], *keys: str) -> Optional[float]:
-            for key in keys:
-                if key in row and row[key] not in (None, ""):
-                    try:
-                        return float(row[key])
-                    except ValueError:
-                        continue
-            return None
-
-        for raw_row in reader:
-            row = {k.lower(): v for k, v in raw_row.items()}
-            x = get(row, "x", "xc", "x_center")
-            y = get(row, "y", "yc", "y_center")
-            w = get(row, "w", "width", "dx")
-            h = get(row, "h", "height", "dy")
+        fieldnames = [name.strip().lstrip("#").lower() for name in header_row]
+        cols = [
+            _find_column(fieldnames, keys) for keys in (_X_KEYS, _Y_KEYS, _W_KEYS, _H_KEYS)
+        ]
+        if any(col is None for col in cols):
+            return boxes
+        ix, iy, iw, ih = cols
+        max_col = max(cols)
 
-            if x is None or y is None:
+        for row in reader:
+            if len(row) <= max_col:
                 continue
-            if w is not None and h is not None:
-                boxes.append(CsvBox(x=x, y=y, width=w, height=h))
-            else:
+            try:
+                boxes.append(
+                    _box_ann(float(row[ix]), float(row[iy]), float(row[iw]), float(row[ih]))
+                )
+            except ValueError:
                 continue
 
     return boxes
 
 
+def _process_stem(
+    task: Tuple[str, str, Optional[Tuple[int, int]], str],
+) -> Tuple[str, int, int, List[Dict[str, object]], bool]:
+    """Worker for one image: probe its size (unless cached) and parse its CSV.
+
+    ``task`` is (image path, relative name, cached (w, h) or None, csv path
+    — empty when the stem has no CSV). Returns (relative name, width,
+    height, ann dicts, size_was_probed).
+    """
+    img_path, rel_name, size, csv_path = task
+    probed = size is None
+    if probed:
+        size = _image_size(Path(img_path))
+    boxes = _parse_csv_boxes(Path(csv_path)) if csv_path else []
+    return rel_name, size[0], size[1], boxes, probed
+
+
 def _collect_annotations_for_split(
     category_root: Path,
     split: str,
     category_name: str,
+    size_cache: Optional[Dict[str, List[int]]] = None,
 ) -> Tuple[List[Dict[str, object]], List[Dict[str, object]], List[Dict[str, object]]]:
-    """Collect COCO dictionaries for images, annotations, and categories."""
+    """Collect COCO dictionaries for images, annotations, and categories.
+
+    When ``size_cache`` is given, image dimensions are looked up there
+    (keyed by relative path, validated against mtime/size) before opening
+    the file; misses are probed and written back into the cache.
+    """
     images_dir = category_root / "images"
     annotations_dir = category_root / "csv"
     sets_dir = category_root / "sets"
 
+    # One directory scan resolves every stem; no per-stem exists() probes.
+    image_map = _scan_image_map(images_dir)
+    csv_stems = _scan_csv_stems(annotations_dir)
+
     split_file = sets_dir / f"{split}.txt"
-    image_stems = set(_read_split_list(split_file))
-    if not image_stems:
+    split_stems = _read_split_list(split_file)
+    if split_stems:
+        stems = sorted(set(split_stems) & image_map.keys())
+    else:
         # If no split list is provided, fall back to all images
-        image_stems = {p.stem for p in images_dir.glob("*.jpg")}
-        image_stems.update({p.stem for p in images_dir.glob("*.JPG")})
-        image_stems.update({p.stem for p in images_dir.glob("*.png")})
+        stems = sorted(image_map)
 
     images: List[Dict[str, object]] = []
     anns: List[Dict[str, object]] = []
@@ -127,40 +328,50 @@ def _collect_annotations_for_split(
         {"id": 1, "name": category_singular, "supercategory": "plant"}
     ]
 
+    # Resolve paths, stats, and cache hits up front; the expensive per-image
+    # work (header probe + CSV parse) runs in the pool below.
+    tasks: List[Tuple[str, str, Optional[Tuple[int, int]], str]] = []
+    stats: Dict[str, Tuple[int, int]] = {}
+    for stem in stems:
+        img_path_str = image_map[stem]
+        img_path = Path(img_path_str)
+
+        rel_name = str(img_path.relative_to(category_root.parent))
+        stat = img_path.stat()
+        stats[rel_name] = (stat.st_mtime_ns, stat.st_size)
+        cached = size_cache.get(rel_name) if size_cache is not None else None
+        size: Optional[Tuple[int, int]] = None
+        if cached is not None and cached[0] == stat.st_mtime_ns and cached[1] == stat.st_size:
+            size = (cached[2], cached[3])
+        csv_path = str(annotations_dir / f"{stem}.csv") if stem in csv_stems else ""
+        tasks.append((img_path_str, rel_name, size, csv_path))
+
+    if tasks:
+        with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+            results = list(executor.map(_process_stem, tasks, chunksize=64))
+    else:
+        results = []
+
+    # executor.map preserves input order, so id assignment stays deterministic.
     image_id_counter = 1
     ann_id_counter = 1
-    for stem in sorted(image_stems):
-        # Try different image extensions
-        img_path = images_dir / f"{stem}.jpg"
-        if not img_path.exists():
-            img_path = images_dir / f"{stem}.JPG"
-        if not img_path.exists():
-            img_path = images_dir / f"{stem}.png"
-        if not img_path.exists():
-            continue
-            
-        width, height = _image_size(img_path)
+    for rel_name, width, height, boxes, probed in results:
+        if probed and size_cache is not None:
+            mtime_ns, file_size = stats[rel_name]
+            size_cache[rel_name] = [mtime_ns, file_size, width, height]
         images.append(
             {
                 "id": image_id_counter,
-                "file_name": str(img_path.relative_to(category_root.parent)),
+                "file_name": rel_name,
                 "width": width,
                 "height": height,
             }
         )
 
-        csv_path = annotations_dir / f"{stem}.csv"
-        for box in _parse_csv_boxes(csv_path):
-            anns.append(
-                {
-                    "id": ann_id_counter,
-                    "image_id": image_id_counter,
-                    "category_id": 1,
-                    "bbox": [box.x, box.y, box.width, box.height],
-                    "area": box.width * box.height,
-                    "iscrowd": 0,
-                }
-            )
+        for ann in boxes:
+            ann["id"] = ann_id_counter
+            ann["image_id"] = image_id_counter
+            anns.append(ann)
             ann_id_counter += 1
 
         image_id_counter += 1
@@ -172,7 +383,12 @@ def _merge_coco_splits(
     per_category: List[Tuple[List[Dict[str, object]], List[Dict[str, object]], List[Dict[str, object]]]],
     category_names: Sequence[str],
 ) -> Tuple[List[Dict[str, object]], List[Dict[str, object]], List[Dict[str, object]]]:
-    """Merge multiple single-category COCO lists into a multi-category dataset."""
+    """Merge multiple single-category COCO lists into a multi-category dataset.
+
+    The input dicts are mutated in place while remapping ids, so
+    ``per_category`` must not be reused afterwards. In ``convert()`` the
+    per-category files are written before the merge, so nothing is lost.
+    """
     images: List[Dict[str, object]] = []
     anns: List[Dict[str, object]] = []
     categories: List[Dict[str, object]] = []
@@ -194,42 +410,78 @@ def _merge_coco_splits(
         id_map: Dict[int, int] = {}
         for img in img_list:
             old_id = int(img["id"])
-            new_img = dict(img)
-            new_img["id"] = next_image_id
-            images.append(new_img)
+            img["id"] = next_image_id
+            images.append(img)
             id_map[old_id] = next_image_id
             next_image_id += 1
 
         for ann in ann_list:
-            new_ann = dict(ann)
-            new_ann["id"] = next_ann_id
-            new_ann["image_id"] = id_map[int(ann["image_id"])]
-            new_ann["category_id"] = category_to_cat[category]
-            anns.append(new_ann)
+            ann["id"] = next_ann_id
+            ann["image_id"] = id_map[int(ann["image_id"])]
+            ann["category_id"] = category_to_cat[category]
+            anns.append(ann)
             next_ann_id += 1
 
     return images, anns, categories
 
 
-def _build_coco_dict(
-    images: List[Dict[str, object]],
-    anns: List[Dict[str, object]],
+def _dumps_record(obj: object) -> bytes:
+    """Serialize one record to compact JSON bytes (orjson when available)."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+def _stream_coco(
+    out_path: Path,
+    images: Iterable[Dict[str, object]],
+    anns: Iterable[Dict[str, object]],
     categories: List[Dict[str, object]],
     description: str,
-) -> Dict[str, object]:
-    """Build a complete COCO dict from components."""
-    return {
-        "info": {
-            "year": 2025,
-            "version": "1.0.0",
-            "description": description,
-            "url": "",
-        },
-        "images": images,
-        "annotations": anns,
-        "categories": categories,
-        "licenses": [],
+) -> None:
+    """Write a COCO JSON file incrementally, one record per line.
+
+    Images and annotations are serialized as they are consumed, so the
+    document is never materialized in memory a second time by the encoder.
+    """
+    info = {
+        "year": 2025,
+        "version": "1.0.0",
+        "description": description,
+        "url": "",
     }
+    with out_path.open("wb") as f:
+        f.write(b'{\n"info": ' + _dumps_record(info) + b',\n"images": [\n')
+        for idx, img in enumerate(images):
+            if idx:
+                f.write(b",\n")
+            f.write(_dumps_record(img))
+        f.write(b'\n],\n"annotations": [\n')
+        for idx, ann in enumerate(anns):
+            if idx:
+                f.write(b",\n")
+            f.write(_dumps_record(ann))
+        f.write(b'\n],\n"categories": ' + _dumps_record(categories))
+        f.write(b',\n"licenses": []\n}\n')
+
+
+def _write_jsonl(
+    out_path: Path,
+    images: Iterable[Dict[str, object]],
+    anns: Iterable[Dict[str, object]],
+) -> None:
+    """Write one JSON object per image, with its annotations inlined.
+
+    The resulting ``.jsonl`` sidecar lets downstream consumers stream the
+    split line by line instead of loading the whole COCO document.
+    """
+    by_image: Dict[object, List[Dict[str, object]]] = {}
+    for ann in anns:
+        by_image.setdefault(ann["image_id"], []).append(ann)
+    with out_path.open("wb") as f:
+        for img in images:
+            obj = {"image": img, "annotations": by_image.get(img["id"], [])}
+            f.write(_dumps_record(obj) + b"\n")
 
 
 def convert(
@@ -238,9 +490,15 @@ def convert(
     categories: Sequence[str],
     splits: Sequence[str],
     combined: bool,
+    jsonl: bool = False,
 ) -> None:
-    """Convert selected categories and splits to COCO JSON files."""
+    """Convert selected categories and splits to COCO JSON files.
+
+    With ``jsonl``, each generated split also gets a ``.jsonl`` sidecar
+    holding one image (plus its annotations) per line.
+    """
     out_dir.mkdir(parents=True, exist_ok=True)
+    size_cache = _load_size_cache(out_dir)
 
     for split in splits:
         # Per-category conversion
@@ -250,21 +508,31 @@ def convert(
             if not category_root.exists():
                 print(f"Warning: Category directory {category_root} does not exist, skipping.")
                 continue
-            images, anns, categories_list = _collect_annotations_for_split(category_root, split, category)
+            images, anns, categories_list = _collect_annotations_for_split(
+                category_root, split, category, size_cache=size_cache
+            )
             desc = f"Plant Village Orange {category} {split} split"
-            coco = _build_coco_dict(images, anns, categories_list, desc)
             out_path = out_dir / f"{category}_instances_{split}.json"
-            out_path.write_text(json.dumps(coco, indent=2), encoding="utf-8")
+            _stream_coco(out_path, images, anns, categories_list, desc)
             print(f"Generated {out_path}: {len(images)} images, {len(anns)} annotations")
+            if jsonl:
+                jsonl_path = out_path.with_suffix(".jsonl")
+                _write_jsonl(jsonl_path, images, anns)
+                print(f"Generated {jsonl_path}")
             per_category_results.append((images, anns, categories_list))
 
         if combined and len(per_category_results) > 1:
             images, anns, categories_list = _merge_coco_splits(per_category_results, categories)
             desc = f"Plant Village Orange combined {split} split ({', '.join(categories)})"
-            coco = _build_coco_dict(images, anns, categories_list, desc)
             out_path = out_dir / f"combined_instances_{split}.json"
-            out_path.write_text(json.dumps(coco, indent=2), encoding="utf-8")
+            _stream_coco(out_path, images, anns, categories_list, desc)
             print(f"Generated {out_path}: {len(images)} images, {len(anns)} annotations")
+            if jsonl:
+                jsonl_path = out_path.with_suffix(".jsonl")
+                _write_jsonl(jsonl_path, images, anns)
+                print(f"Generated {jsonl_path}")
+
+    _save_size_cache(out_dir, size_cache)
 
 
 def _parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
@@ -301,6 +569,11 @@ def _parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
         action="store_true",
         help="Also produce a combined multi-class JSON per split",
     )
+    parser.add_argument(
+        "--jsonl",
+        action="store_true",
+        help="Also write a JSON-Lines sidecar (one image per line) per split",
+    )
 
     return parser.parse_args(argv)
 
@@ -314,6 +587,7 @@ def main(argv: Optional[Sequence[str]] = None) -> int:
         categories=args.categories,
         splits=args.splits,
         combined=bool(args.combined),
+        jsonl=bool(args.jsonl),
     )
     return 0
 
@@ -6,34 +6,64 @@
 import json
 from pathlib import Path
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import orjson
+except ImportError:  # 可选依赖，用于加速JSON解析
+    orjson = None
+
+# 归一化时只剥离这些已知图像扩展名；不能用 Path.stem，
+# 否则文件名里的点（如 "UF.Citrus_HLB_Lab 0001"）会被误当作扩展名截断
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png')
+
+def normalize_name(name):
+    """归一化文件名：转小写，仅当后缀是已知图像扩展名时才去掉"""
+    lowered = name.lower()
+    for ext in IMAGE_EXTS:
+        if lowered.endswith(ext):
+            return lowered[:-len(ext)]
+    return lowered
+
+def _extract_original_name(json_file):
+    """读取单个JSON文件，返回 (实际词干, 原始文件名)；失败或缺字段时返回 None"""
+    try:
+        raw = json_file.read_bytes()
+        data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+    except Exception as e:
+        print(f"Warning: Failed to process {json_file}: {e}")
+        return None
+    images = data.get('images') or []
+    if not images:
+        return None
+    img_info = images[0]
+    # 获取原始文件名（不含扩展名）
+    original = img_info.get('pvc_filename', '') or img_info.get('original_filename', '')
+    if not original:
+        return None
+    return json_file.stem, original
 
 def build_filename_mapping(json_dir):
-    """从JSON文件中构建原始文件名到实际文件名的映射"""
+    """从JSON文件中构建原始文件名到实际文件名的映射（多线程扫描JSON）"""
     mapping = {}
     json_path = Path(json_dir)
-    
-    for json_file in json_path.glob("*.json"):
-        try:
-            with open(json_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                if 'images' in data and len(data['images']) > 0:
-                    img_info = data['images'][0]
-                    # 获取原始文件名（不含扩展名）
-                    original = img_info.get('pvc_filename', '')
-                    if not original:
-                        original = img_info.get('original_filename', '')
-                    if original:
-                        original_stem = Path(original).stem
-                        actual_stem = json_file.stem
-                        # 存储多个可能的映射键
-                        mapping[original_stem] = actual_stem
-                        mapping[original] = actual_stem  # 包含扩展名
-                        # 也存储小写版本
-                        mapping[original_stem.lower()] = actual_stem
-                        mapping[original.lower()] = actual_stem
-        except Exception as e:
-            print(f"Warning: Failed to process {json_file}: {e}")
-    
+
+    # 每个文件互相独立，用线程池并发读取和解析
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        results = list(executor.map(_extract_original_name, json_path.glob("*.json")))
+
+    for result in results:
+        if result is None:
+            continue
+        actual_stem, original = result
+        original_stem = Path(original).stem
+        # 存储多个可能的映射键
+        mapping[original_stem] = actual_stem
+        mapping[original] = actual_stem  # 包含扩展名
+        # 也存储小写版本
+        mapping[original_stem.lower()] = actual_stem
+        mapping[original.lower()] = actual_stem
+
     return mapping
 
 def fix_splits(category_dir, all_dir):
@@ -46,9 +76,12 @@ def fix_splits(category_dir, all_dir):
     mapping = build_filename_mapping(json_dir)
     print(f"构建了 {len(mapping)} 个文件名映射")
     
+    # 预先归一化映射键（仅去已知图像扩展名并小写），每行只做一次 O(1) 查找
+    norm_mapping = {normalize_name(k): v for k, v in mapping.items()}
+
     # 反向映射：从实际文件名到原始文件名
     reverse_mapping = {v: k for k, v in mapping.items()}
-    
+
     # 处理每个划分文件
     for split_file in ['train.txt', 'val.txt', 'test.txt']:
         split_path = all_path / split_file
@@ -61,33 +94,15 @@ def fix_splits(category_dir, all_dir):
         with open(split_path, 'r', encoding='utf-8') as f:
             original_lines = [line.strip() for line in f if line.strip()]
         
-        # 映射到实际文件名
-        mapped_lines = []
+        # 映射到实际文件名：归一化后单次查找即可覆盖原有的各种匹配方式
+        # 直接用 set 收集，省去写出前的一次去重
+        mapped_lines = set()
         unmapped = []
         for line in original_lines:
-            # 移除扩展名（如果存在）
-            line_stem = Path(line).stem
-            line_lower = line.lower()
-            line_stem_lower = line_stem.lower()
-            
-            # 尝试多种匹配方式
-            found = False
-            for key in [line, line_stem, line_lower, line_stem_lower]:
-                if key in mapping:
-                    mapped_lines.append(mapping[key])
-                    found = True
-                    break
-            
-            if not found:
-                # 尝试部分匹配（处理可能的变体）
-                for orig, actual in mapping.items():
-                    orig_stem = Path(orig).stem if '.' in orig else orig
-                    if orig_stem == line_stem or orig_stem == line_stem_lower:
-                        mapped_lines.append(actual)
-                        found = True
-                        break
-            
-            if not found:
+            actual = norm_mapping.get(normalize_name(line))
+            if actual is not None:
+                mapped_lines.add(actual)
+            else:
                 unmapped.append(line)
         
         if unmapped:
@@ -101,10 +116,9 @@ def fix_splits(category_dir, all_dir):
         target_split = sets_dir / split_file
         
         with open(target_split, 'w', encoding='utf-8') as f:
-            for line in sorted(set(mapped_lines)):  # 去重并排序
-                f.write(f"{line}\n")
-        
-        print(f"  写入 {len(set(mapped_lines))} 个图像到 {target_split}")
+            f.writelines(f"{line}\n" for line in sorted(mapped_lines))  # 排序后写出
+
+        print(f"  写入 {len(mapped_lines)} 个图像到 {target_split}")
 
 def main():
     root_dir = Path(__file__).parent.parent
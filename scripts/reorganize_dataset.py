@@ -6,32 +6,65 @@
 
 import os
 import json
+import re
 import shutil
 from pathlib import Path
 from collections import defaultdict
 
+try:
+    import orjson
+except ImportError:  # 可选依赖，用于加速JSON解析
+    orjson = None
+
+try:
+    import ijson
+except ImportError:  # 可选依赖，用于流式解析大JSON
+    ijson = None
+
+# 超过该大小的JSON走流式解析，小文件整块解析开销更低
+STREAM_THRESHOLD = 1024 * 1024
+
+# Orange类别文件名特征，单次正则扫描代替多个子串查找
+ORANGE_NAME_RE = re.compile(r'CREC_HLB|UF\.Citrus_HLB|image \(')
+
+def fast_copy(src, dst):
+    """复制文件：同一文件系统上用硬链接（O(1)，不复制字节），否则回退到普通复制"""
+    dst = Path(dst)
+    try:
+        if dst.exists():
+            dst.unlink()
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
 def read_json_file(json_path):
-    """读取JSON标注文件"""
-    with open(json_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    """读取JSON标注文件（整块读入，可用时用 orjson 解析）"""
+    with open(json_path, 'rb') as f:
+        raw = f.read()
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw.decode('utf-8'))
 
 def json_to_csv(json_data, csv_path):
-    """将JSON标注转换为CSV格式"""
+    """将JSON标注转换为CSV格式（在内存中拼好所有行后一次写入）"""
     annotations = json_data.get('annotations', [])
-    if not annotations:
-        # 创建空CSV文件
-        with open(csv_path, 'w', encoding='utf-8') as f:
-            f.write("#item,x,y,width,height,label\n")
-        return
-    
-    with open(csv_path, 'w', encoding='utf-8') as f:
-        f.write("#item,x,y,width,height,label\n")
-        for idx, ann in enumerate(annotations):
+    lines = ["#item,x,y,width,height,label"]
+    for idx, ann in enumerate(annotations):
+        bbox = ann['bbox']  # [x, y, width, height]
+        category_id = ann['category_id']
+        # 将category_id映射到标准label (1 for object, 0 for background)
+        label = 1 if category_id != 0 else 0
+        lines.append(f"{idx},{bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]},{label}")
+    Path(csv_path).write_text("\n".join(lines) + "\n", encoding='utf-8')
+
+def json_to_csv_streaming(json_path, csv_path):
+    """流式读取JSON标注并生成CSV，内存占用与单条标注成正比（用于大文件）"""
+    with open(json_path, 'rb') as src, open(csv_path, 'w', encoding='utf-8') as dst:
+        dst.write("#item,x,y,width,height,label\n")
+        for idx, ann in enumerate(ijson.items(src, 'annotations.item')):
             bbox = ann['bbox']  # [x, y, width, height]
-            category_id = ann['category_id']
-            # 将category_id映射到标准label (1 for object, 0 for background)
-            label = 1 if category_id != 0 else 0
-            f.write(f"{idx},{bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]},{label}\n")
+            label = 1 if ann['category_id'] != 0 else 0
+            dst.write(f"{idx},{bbox[0]},{bbox[1]},{bbox[2]},{bbox[3]},{label}\n")
 
 def reorganize_category(source_dir, target_category_dir, category_name, image_ext='.JPG'):
     """重组单个类别的数据"""
@@ -78,21 +111,22 @@ def process_directory(source_dir, images_dir, json_dir, csv_dir, image_ext):
             # 尝试不同的扩展名
             json_file = source_path / f"{img_file.name}.json"
         
-        # 复制图像文件
+        # 复制图像文件（优先硬链接）
         target_img = images_dir / img_file.name
-        shutil.copy2(img_file, target_img)
+        fast_copy(img_file, target_img)
         
-        # 处理JSON文件
+        # 处理JSON文件：硬链接到目标目录后只读取并解析一次，直接生成CSV
         if json_file.exists():
-            # 复制JSON文件
             target_json = json_dir / f"{stem}.json"
-            shutil.copy2(json_file, target_json)
-            
-            # 读取JSON并生成CSV
+            fast_copy(json_file, target_json)
+
             try:
-                json_data = read_json_file(json_file)
                 csv_file = csv_dir / f"{stem}.csv"
-                json_to_csv(json_data, csv_file)
+                if ijson is not None and json_file.stat().st_size >= STREAM_THRESHOLD:
+                    json_to_csv_streaming(json_file, csv_file)
+                else:
+                    json_data = read_json_file(json_file)
+                    json_to_csv(json_data, csv_file)
             except Exception as e:
                 print(f"  警告: 处理 {json_file} 时出错: {e}")
         else:
@@ -120,17 +154,9 @@ def reorganize_splits(all_dir, category_dirs):
         category_lines = defaultdict(list)
         
         for line in lines:
-            # 判断属于哪个类别
-            # 根据文件名特征判断
-            if 'CREC_HLB' in line or 'UF.Citrus_HLB' in line or 'image (' in line:
-                # Orange类别
-                # 提取文件名（不含扩展名）
-                stem = Path(line).stem
-                category_lines['oranges'].append(stem)
-            else:
-                # Background类别
-                stem = Path(line).stem
-                category_lines['backgrounds'].append(stem)
+            # 根据文件名特征判断类别，提取文件名（不含扩展名）
+            key = 'oranges' if ORANGE_NAME_RE.search(line) else 'backgrounds'
+            category_lines[key].append(Path(line).stem)
         
         # 为每个类别创建划分文件
         for category_name, category_dir in category_dirs.items():
@@ -202,16 +228,20 @@ def main():
         if category_dir.exists():
             images_dir = category_dir / 'images'
             if images_dir.exists():
-                image_files = list(images_dir.glob("*.JPG")) + list(images_dir.glob("*.jpg"))
+                # 单次扫描目录（扩展名不区分大小写），排序后一次写出
+                with os.scandir(images_dir) as it:
+                    stems = sorted(
+                        os.path.splitext(entry.name)[0]
+                        for entry in it
+                        if os.path.splitext(entry.name)[1].lower() == '.jpg'
+                    )
                 sets_dir = category_dir / 'sets'
                 sets_dir.mkdir(parents=True, exist_ok=True)
-                
+
                 all_txt = sets_dir / 'all.txt'
-                with open(all_txt, 'w', encoding='utf-8') as f:
-                    for img_file in sorted(image_files):
-                        f.write(f"{img_file.stem}\n")
-                
-                print(f"{category_name}: 创建 all.txt，包含 {len(image_files)} 个图像")
+                all_txt.write_text("\n".join(stems) + "\n" if stems else "", encoding='utf-8')
+
+                print(f"{category_name}: 创建 all.txt，包含 {len(stems)} 个图像")
     
     print("\n数据集重组完成！")
 